@@ -0,0 +1,101 @@
+import math
+import numba
+import numpy as np
+
+
+@numba.jit(nopython=True, cache=True, fastmath=True)
+def equation_plane(points):
+    x1, y1, z1 = points[0, 0], points[0, 1], points[0, 2]
+    x2, y2, z2 = points[1, 0], points[1, 1], points[1, 2]
+    x3, y3, z3 = points[2, 0], points[2, 1], points[2, 2]
+    a1 = x2 - x1
+    b1 = y2 - y1
+    c1 = z2 - z1
+    a2 = x3 - x1
+    b2 = y3 - y1
+    c2 = z3 - z1
+    plane = np.empty(4)
+    plane[0] = b1 * c2 - b2 * c1
+    plane[1] = a2 * c1 - a1 * c2
+    plane[2] = a1 * b2 - b1 * a2
+    plane[3] = -plane[0] * x1 - plane[1] * y1 - plane[2] * z1
+    return plane
+
+
+@numba.jit(nopython=True, cache=True, fastmath=True)
+def get_denorm(sweepego2sweepsensor):
+    # The ground points (0, 0, 0), (0, 1, 0) and (1, 1, 0) are constant, so
+    # their projection reduces to sums of the rotation columns plus the
+    # translation.
+    ground_points_cam = np.empty((3, 3))
+    for i in range(3):
+        tran = sweepego2sweepsensor[i, 3]
+        ground_points_cam[0, i] = tran
+        ground_points_cam[1, i] = sweepego2sweepsensor[i, 1] + tran
+        ground_points_cam[2, i] = sweepego2sweepsensor[i, 0] + \
+            sweepego2sweepsensor[i, 1] + tran
+    denorm = -1 * equation_plane(ground_points_cam)
+    return denorm
+
+
+@numba.jit(nopython=True, cache=True, fastmath=True)
+def get_sensor2virtual(denorm):
+    # Rotate the ground normal onto the y axis (0, 1, 0).
+    norm = math.sqrt(denorm[0]**2 + denorm[1]**2 + denorm[2]**2)
+    tx, ty, tz = -denorm[0] / norm, -denorm[1] / norm, -denorm[2] / norm
+    sita = math.acos(ty)
+    # n = target x origin = (-tz, 0, tx)
+    n_norm = math.sqrt(tz**2 + tx**2)
+    # The normal is already along the y axis and the rotation axis is
+    # undefined: no rotation, or half a turn about x if it points up.
+    if n_norm < 1e-12:
+        sensor2virtual = np.eye(4, dtype=np.float32)
+        if ty < 0:
+            sensor2virtual[1, 1] = -1.0
+            sensor2virtual[2, 2] = -1.0
+        return sensor2virtual
+    kx, ky, kz = -tz / n_norm, 0.0, tx / n_norm
+    # Rodrigues' rotation formula.
+    cos_sita, sin_sita = math.cos(sita), math.sin(sita)
+    one_cos = 1.0 - cos_sita
+    sensor2virtual = np.zeros((4, 4), dtype=np.float32)
+    sensor2virtual[0, 0] = cos_sita + one_cos * kx * kx
+    sensor2virtual[0, 1] = one_cos * kx * ky - sin_sita * kz
+    sensor2virtual[0, 2] = one_cos * kx * kz + sin_sita * ky
+    sensor2virtual[1, 0] = one_cos * ky * kx + sin_sita * kz
+    sensor2virtual[1, 1] = cos_sita + one_cos * ky * ky
+    sensor2virtual[1, 2] = one_cos * ky * kz - sin_sita * kx
+    sensor2virtual[2, 0] = one_cos * kz * kx - sin_sita * ky
+    sensor2virtual[2, 1] = one_cos * kz * ky + sin_sita * kx
+    sensor2virtual[2, 2] = cos_sita + one_cos * kz * kz
+    sensor2virtual[3, 3] = 1.0
+    return sensor2virtual
+
+
+@numba.jit(nopython=True, cache=True, fastmath=True)
+def get_reference_height(denorm):
+    ref_height = abs(denorm[3]) / math.sqrt(denorm[0]**2 + denorm[1]**2 +
+                                            denorm[2]**2)
+    return np.float32(ref_height)
+
+
+def quaternion_to_rotation_matrix(quaternions):
+    """Convert (N, 4) w, x, y, z quaternions to (N, 3, 3) rotation matrices.
+
+    Quaternions are normalized first, like ``pyquaternion`` does.
+    """
+    quaternions = np.asarray(quaternions, dtype=np.float64).reshape(-1, 4)
+    quaternions = quaternions / np.linalg.norm(
+        quaternions, axis=1, keepdims=True)
+    w, x, y, z = quaternions.T
+    rot = np.empty((len(quaternions), 3, 3))
+    rot[:, 0, 0] = 1 - 2 * (y * y + z * z)
+    rot[:, 0, 1] = 2 * (x * y - z * w)
+    rot[:, 0, 2] = 2 * (x * z + y * w)
+    rot[:, 1, 0] = 2 * (x * y + z * w)
+    rot[:, 1, 1] = 1 - 2 * (x * x + z * z)
+    rot[:, 1, 2] = 2 * (y * z - x * w)
+    rot[:, 2, 0] = 2 * (x * z - y * w)
+    rot[:, 2, 1] = 2 * (y * z + x * w)
+    rot[:, 2, 2] = 1 - 2 * (x * x + y * y)
+    return rot
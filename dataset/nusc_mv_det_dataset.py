@@ -1,18 +1,35 @@
 import os
 import math
+import hashlib
+import tempfile
+import warnings
 import cv2
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
-import random
 import mmcv
 import numpy as np
 import torch
 from mmdet3d.core.bbox.structures.lidar_box3d import LiDARInstance3DBoxes
-from nuscenes.utils.data_classes import Box, LidarPointCloud
-from nuscenes.utils.geometry_utils import view_points
 
-from PIL import Image
 from pyquaternion import Quaternion
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, get_worker_info
+
+from dataset.geometry_utils import (get_denorm, get_reference_height,
+                                    get_sensor2virtual,
+                                    quaternion_to_rotation_matrix)
+
+try:
+    from turbojpeg import TJPF_BGR, TurboJPEG
+    _turbo_jpeg = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    _turbo_jpeg = None
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
 
 __all__ = ['NuscMVDetDataset']
 
@@ -42,127 +59,168 @@ map_name_from_general_to_detection = {
     'static_object.bicycle_rack': 'ignore',
 }
 
-def equation_plane(points): 
-    x1, y1, z1 = points[0, 0], points[0, 1], points[0, 2]
-    x2, y2, z2 = points[1, 0], points[1, 1], points[1, 2]
-    x3, y3, z3 = points[2, 0], points[2, 1], points[2, 2]
-    a1 = x2 - x1
-    b1 = y2 - y1
-    c1 = z2 - z1
-    a2 = x3 - x1
-    b2 = y3 - y1
-    c2 = z3 - z1
-    a = b1 * c2 - b2 * c1
-    b = a2 * c1 - a1 * c2
-    c = a1 * b2 - b1 * a2
-    d = (- a * x1 - b * y1 - c * z1)
-    return np.array([a, b, c, d])
-
-def get_denorm(sweepego2sweepsensor):
-    ground_points_lidar = np.array([[0.0, 0.0, 0.0], [0.0, 1.0, 0.0], [1.0, 1.0, 0.0]])
-    ground_points_lidar = np.concatenate((ground_points_lidar, np.ones((ground_points_lidar.shape[0], 1))), axis=1)
-    ground_points_cam = np.matmul(sweepego2sweepsensor, ground_points_lidar.T).T
-    denorm = -1 * equation_plane(ground_points_cam)
-    return denorm
-
-def get_sensor2virtual(denorm):
-    origin_vector = np.array([0, 1, 0])    
-    target_vector = -1 * np.array([denorm[0], denorm[1], denorm[2]])
-    target_vector_norm = target_vector / np.sqrt(target_vector[0]**2 + target_vector[1]**2 + target_vector[2]**2)       
-    sita = math.acos(np.inner(target_vector_norm, origin_vector))
-    n_vector = np.cross(target_vector_norm, origin_vector) 
-    n_vector = n_vector / np.sqrt(n_vector[0]**2 + n_vector[1]**2 + n_vector[2]**2)
-    n_vector = n_vector.astype(np.float32)
-    rot_mat, _ = cv2.Rodrigues(n_vector * sita)
-    rot_mat = rot_mat.astype(np.float32)
-    sensor2virtual = np.eye(4)
-    sensor2virtual[:3, :3] = rot_mat
-    return sensor2virtual.astype(np.float32)
-
-def get_reference_height(denorm):
-    ref_height = np.abs(denorm[3]) / np.sqrt(denorm[0]**2 + denorm[1]**2 + denorm[2]**2)
-    return ref_height.astype(np.float32)
+
+# Mean and inverse std tensors used by `normalize_imgs`, keyed by device.
+_img_norm_params = dict()
+
+
+def imread(img_path):
+    """Decode an image file to a BGR uint8 array.
+
+    JPEGs are decoded with libjpeg-turbo when PyTurboJPEG is available,
+    everything else falls back to OpenCV.
+    """
+    if _turbo_jpeg is not None and img_path.lower().endswith(
+            ('.jpg', '.jpeg')):
+        with open(img_path, 'rb') as f:
+            return _turbo_jpeg.decode(f.read(), pixel_format=TJPF_BGR)
+    img = cv2.imread(img_path, cv2.IMREAD_COLOR)
+    # OpenCV only logs a warning for files it cannot read.
+    if img is None:
+        raise FileNotFoundError(f'Cannot read image {img_path}')
+    return img
+
+
+def normalize_imgs(imgs, img_mean, img_std):
+    """Normalize the uint8 images returned by the dataset.
+
+    Meant to be called on the training device after the batch has been
+    moved there, so workers only ship uint8 pixels.
+
+    Args:
+        imgs (Tensor): uint8 images of shape (..., 3, H, W).
+        img_mean (list[float]): Mean of each channel.
+        img_std (list[float]): Std of each channel.
+
+    Returns:
+        Tensor: float32 images with the memory layout of `imgs`.
+    """
+    key = (imgs.device, tuple(img_mean), tuple(img_std))
+    if key not in _img_norm_params:
+        mean = torch.tensor(img_mean, dtype=torch.float32, device=imgs.device)
+        std = torch.tensor(img_std, dtype=torch.float32, device=imgs.device)
+        _img_norm_params[key] = (mean.view(3, 1, 1), (1 / std).view(3, 1, 1))
+    mean, inv_std = _img_norm_params[key]
+    return imgs.float().sub_(mean).mul_(inv_std)
 
 def get_rot(h):
-    return torch.Tensor([
-        [np.cos(h), np.sin(h)],
-        [-np.sin(h), np.cos(h)],
-    ])
-
-def img_intrin_extrin_transform(img, ratio, roll, transform_pitch, intrin_mat, fillcolor=(0,0,0)):
-    center = intrin_mat[:2, 2].astype(np.int32) 
-    center = (int(center[0]), int(center[1]))
-
-    W, H = img.size[0], img.size[1]
-    new_W, new_H = (int(W * ratio), int(H * ratio))
-    img = img.resize((new_W, new_H), Image.ANTIALIAS)
-    
-    h_min = int(center[1] * abs(1.0 - ratio))
-    w_min = int(center[0] * abs(1.0 - ratio))
-    if ratio <= 1.0:
-        image = Image.new(mode='RGB', size=(W, H))
-        image.paste(img, (w_min, h_min,  w_min + new_W, h_min + new_H))
+    cos, sin = math.cos(h), math.sin(h)
+    return np.array([[cos, sin], [-sin, cos]], dtype=np.float32)
+
+
+def get_intrin_extrin_warp_mat(ratio, roll, transform_pitch, intrin_mat):
+    # Scale by ratio and rotate by roll about the principal point, then
+    # shift by pitch, as a single affine warp.
+    center = (float(intrin_mat[0, 2]), float(intrin_mat[1, 2]))
+    warp_mat = cv2.getRotationMatrix2D(center, -roll, ratio)
+    warp_mat[1, 2] += transform_pitch
+    return warp_mat
+
+
+def cuda_warp_available():
+    """Whether OpenCV was built with CUDA and sees a device."""
+    return hasattr(cv2, 'cuda') and cv2.cuda.getCudaEnabledDeviceCount() > 0
+
+def img_intrin_extrin_transform(img, ratio, roll, transform_pitch, intrin_mat, fillcolor=(0,0,0), use_cuda=False):
+    H, W = img.shape[:2]
+    warp_mat = get_intrin_extrin_warp_mat(ratio, roll, transform_pitch,
+                                          intrin_mat)
+    if use_cuda:
+        gpu_img = cv2.cuda_GpuMat()
+        gpu_img.upload(img)
+        img = cv2.cuda.warpAffine(gpu_img, warp_mat, (W, H),
+                                  flags=cv2.INTER_LINEAR,
+                                  borderMode=cv2.BORDER_CONSTANT,
+                                  borderValue=fillcolor).download()
     else:
-        image = img.crop((w_min, h_min,  w_min + W, h_min + H))
-    img = image.rotate(-roll, expand=0, center=center, translate=(0, transform_pitch), fillcolor=fillcolor, resample=Image.BICUBIC)
+        img = cv2.warpAffine(img, warp_mat, (W, H), flags=cv2.INTER_LINEAR,
+                             borderMode=cv2.BORDER_CONSTANT,
+                             borderValue=fillcolor)
     return img
 
-def img_transform(img, resize, resize_dims, crop, flip, rotate):
-    ida_rot = torch.eye(2)
-    ida_tran = torch.zeros(2)
-    # adjust image
-    img = img.resize(resize_dims)
-    img = img.crop(crop)
-    if flip:
-        img = img.transpose(method=Image.FLIP_LEFT_RIGHT)
-    img = img.rotate(rotate)
 
+def get_ida_mat(resize, crop, flip, rotate):
     # post-homography transformation
-    ida_rot *= resize
-    ida_tran -= torch.Tensor(crop[:2])
+    ida_rot = np.eye(2, dtype=np.float32) * resize
+    ida_tran = -np.array(crop[:2], dtype=np.float32)
     if flip:
-        A = torch.Tensor([[-1, 0], [0, 1]])
-        b = torch.Tensor([crop[2] - crop[0], 0])
-        ida_rot = A.matmul(ida_rot)
-        ida_tran = A.matmul(ida_tran) + b
+        # Mirror x about the crop width.
+        ida_rot[0] = -ida_rot[0]
+        ida_tran[0] = crop[2] - crop[0] - ida_tran[0]
     A = get_rot(rotate / 180 * np.pi)
-    b = torch.Tensor([crop[2] - crop[0], crop[3] - crop[1]]) / 2
-    b = A.matmul(-b) + b
-    ida_rot = A.matmul(ida_rot)
-    ida_tran = A.matmul(ida_tran) + b
-    ida_mat = ida_rot.new_zeros(4, 4)
-    ida_mat[3, 3] = 1
-    ida_mat[2, 2] = 1
+    b = np.array([crop[2] - crop[0], crop[3] - crop[1]], dtype=np.float32) / 2
+    b = A @ -b + b
+    ida_rot = A @ ida_rot
+    ida_tran = A @ ida_tran + b
+
+    ida_mat = np.eye(4, dtype=np.float32)
     ida_mat[:2, :2] = ida_rot
     ida_mat[:2, 3] = ida_tran
+    return ida_mat
+
+def img_transform(img, resize, resize_dims, crop, flip, rotate):
+    ida_mat = get_ida_mat(resize, crop, flip, rotate)
+    # adjust image: resize, crop, flip and rotate in one affine warp.
+    img = cv2.warpAffine(img, ida_mat[:2, [0, 1, 3]],
+                         (crop[2] - crop[0], crop[3] - crop[1]),
+                         flags=cv2.INTER_LINEAR,
+                         borderMode=cv2.BORDER_CONSTANT, borderValue=0)
     return img, ida_mat
 
 
-def bev_transform(gt_boxes, rotate_angle, scale_ratio, flip_dx, flip_dy):
-    rotate_angle = torch.tensor(rotate_angle / 180 * np.pi)
-    rot_sin = torch.sin(rotate_angle)
-    rot_cos = torch.cos(rotate_angle)
-    rot_mat = torch.Tensor([[rot_cos, -rot_sin, 0], [rot_sin, rot_cos, 0],
-                            [0, 0, 1]])
-    scale_mat = torch.Tensor([[scale_ratio, 0, 0], [0, scale_ratio, 0],
-                              [0, 0, scale_ratio]])
-    flip_mat = torch.Tensor([[1, 0, 0], [0, 1, 0], [0, 0, 1]])
+def get_mean_ego_pose(cam_infos, cams):
+    """Average the ego poses of `cams`.
+
+    Returns:
+        np.ndarray: Mean rotation as a w, x, y, z quaternion.
+        np.ndarray: Mean translation.
+    """
+    rotations = np.empty((len(cams), 4))
+    translations = np.empty((len(cams), 3))
+    for i, cam in enumerate(cams):
+        ego_pose = cam_infos[cam]['ego_pose']
+        rotations[i] = ego_pose['rotation']
+        translations[i] = ego_pose['translation']
+    return rotations.mean(0), translations.mean(0)
+
+
+@lru_cache(maxsize=64)
+def get_bda_mat(rotate_angle, scale_ratio, flip_dx, flip_dy):
+    """Build the 4x4 bda matrix.
+
+    Samples only draw from a handful of bda settings, so the matrices are
+    cached; callers must not modify the returned array.
+    """
+    rotate_angle = rotate_angle / 180 * np.pi
+    rot_sin = math.sin(rotate_angle)
+    rot_cos = math.cos(rotate_angle)
+    # flip @ scale @ rot: scaling is uniform and the flips negate rows.
+    bda_mat = np.eye(4, dtype=np.float32)
+    bda_mat[:3, :3] = np.array([[rot_cos, -rot_sin, 0], [rot_sin, rot_cos, 0],
+                                [0, 0, 1]]) * scale_ratio
     if flip_dx:
-        flip_mat = flip_mat @ torch.Tensor([[-1, 0, 0], [0, 1, 0], [0, 0, 1]])
+        bda_mat[0, :3] = -bda_mat[0, :3]
     if flip_dy:
-        flip_mat = flip_mat @ torch.Tensor([[1, 0, 0], [0, -1, 0], [0, 0, 1]])
-    rot_mat = flip_mat @ (scale_mat @ rot_mat)
-    if gt_boxes.shape[0] > 0:
-        gt_boxes[:, :3] = (rot_mat @ gt_boxes[:, :3].unsqueeze(-1)).squeeze(-1)
+        bda_mat[1, :3] = -bda_mat[1, :3]
+    return bda_mat
+
+
+def bev_transform(gt_boxes, rotate_angle, scale_ratio, flip_dx, flip_dy):
+    bda_mat = get_bda_mat(rotate_angle, scale_ratio, flip_dx, flip_dy)
+    # The identity leaves the boxes untouched.
+    if gt_boxes.shape[0] > 0 and (rotate_angle != 0 or scale_ratio != 1
+                                  or flip_dx or flip_dy):
+        rot_mat = bda_mat[:3, :3]
+        rotate_angle = rotate_angle / 180 * np.pi
+        gt_boxes[:, :3] = gt_boxes[:, :3] @ rot_mat.T
         gt_boxes[:, 3:6] *= scale_ratio
         gt_boxes[:, 6] += rotate_angle
         if flip_dx:
-            gt_boxes[:, 6] = 2 * torch.asin(torch.tensor(1.0)) - gt_boxes[:, 6]
+            gt_boxes[:, 6] = math.pi - gt_boxes[:, 6]
         if flip_dy:
             gt_boxes[:, 6] = -gt_boxes[:, 6]
-        gt_boxes[:, 7:] = (
-            rot_mat[:2, :2] @ gt_boxes[:, 7:].unsqueeze(-1)).squeeze(-1)
-    return gt_boxes, rot_mat
+        gt_boxes[:, 7:] = gt_boxes[:, 7:] @ rot_mat[:2, :2].T
+    return gt_boxes, torch.from_numpy(bda_mat.copy())
 
 
 def depth_transform(cam_depth, resize, resize_dims, crop, flip, rotate):
@@ -191,36 +249,28 @@ def depth_transform(cam_depth, resize, resize_dims, crop, flip, rotate):
     cam_depth[:, 1] -= H / 2.0
 
     h = rotate / 180 * np.pi
-    rot_matrix = [
-        [np.cos(h), np.sin(h)],
-        [-np.sin(h), np.cos(h)],
-    ]
-    cam_depth[:, :2] = np.matmul(rot_matrix, cam_depth[:, :2].T).T
+    cam_depth[:, :2] = cam_depth[:, :2] @ np.array(
+        [[np.cos(h), -np.sin(h)], [np.sin(h), np.cos(h)]],
+        dtype=cam_depth.dtype)
 
     cam_depth[:, 0] += W / 2.0
     cam_depth[:, 1] += H / 2.0
 
-    depth_coords = cam_depth[:, :2].astype(np.int16)
-
-    depth_map = np.zeros(resize_dims)
-    valid_mask = ((depth_coords[:, 1] < resize_dims[0])
-                  & (depth_coords[:, 0] < resize_dims[1])
-                  & (depth_coords[:, 1] >= 0)
-                  & (depth_coords[:, 0] >= 0))
-    depth_map[depth_coords[valid_mask, 1],
-              depth_coords[valid_mask, 0]] = cam_depth[valid_mask, 2]
+    return get_depth_map(cam_depth, resize_dims)
 
-    return depth_map
-
-def get_depth_map(cam_depth, dims):
-    depth_coords = cam_depth[:, :2].astype(np.int16)
-    depth_map = np.zeros(dims)
-    valid_mask = ((depth_coords[:, 1] < dims[0])
-                  & (depth_coords[:, 0] < dims[1])
-                  & (depth_coords[:, 1] >= 0)
-                  & (depth_coords[:, 0] >= 0))
-    depth_map[depth_coords[valid_mask, 1],
-              depth_coords[valid_mask, 0]] = cam_depth[valid_mask, 2]
+def get_depth_map(cam_depth, dims, out=None):
+    # `out` is an optional contiguous buffer to rasterize into.
+    depth_coords = np.floor(cam_depth[:, :2]).astype(np.int32)
+    if out is None:
+        depth_map = np.zeros(dims)
+    else:
+        depth_map = out
+        depth_map.fill(0)
+    valid_mask = ((depth_coords[:, 0] >= 0) & (depth_coords[:, 0] < dims[1])
+                  & (depth_coords[:, 1] >= 0) & (depth_coords[:, 1] < dims[0]))
+    depth_coords = depth_coords[valid_mask]
+    depth_map.ravel()[depth_coords[:, 1] * dims[1] +
+                      depth_coords[:, 0]] = cam_depth[valid_mask, 2]
 
     return depth_map
 
@@ -232,26 +282,39 @@ def map_pointcloud_to_image(
     cam_calibrated_sensor,
     min_dist: float = 0.0,
 ):
-    lidar_points = LidarPointCloud(lidar_points.T)
-    lidar_points.rotate(lidar_calibrated_sensor['rotation_matrix'])
-    lidar_points.translate(np.array(lidar_calibrated_sensor['translation']))
-
-    depths = lidar_points.points[2, :]
-    coloring = depths
-    points = view_points(lidar_points.points[:3, :],
-                        np.array(cam_calibrated_sensor['camera_intrinsic']),
-                        normalize=True)
-    mask = np.ones(depths.shape[0], dtype=bool)
-    mask = np.logical_and(mask, depths > min_dist)
-    mask = np.logical_and(mask, points[0, :] > 1)
-    mask = np.logical_and(mask, points[0, :] < img.size[0] - 1)
-    mask = np.logical_and(mask, points[1, :] > 1)
-    mask = np.logical_and(mask, points[1, :] < img.size[1] - 1)
-    points = points[:, mask]
-    coloring = coloring[mask]
+    rotation = np.asarray(lidar_calibrated_sensor['rotation_matrix'])
+    translation = np.asarray(lidar_calibrated_sensor['translation'])
+    lidar_points = lidar_points[:, :3]
+    # Depth is a single dot product, so drop the points behind the camera
+    # before copying and transforming the rest.
+    depths = lidar_points @ rotation[2] + translation[2]
+    front_idxes = np.flatnonzero(depths > min_dist)
+    points = lidar_points[front_idxes] @ rotation.T + translation
+
+    coloring = depths[front_idxes]
+    intrinsic = np.asarray(cam_calibrated_sensor['camera_intrinsic'])
+    points = points @ intrinsic[:, :3].T
+    if intrinsic.shape[1] == 4:
+        points += intrinsic[:, 3]
+    points = points[:, :2] / points[:, 2:3]
+    x, y = points[:, 0], points[:, 1]
+    x_max, y_max = img.shape[1] - 1, img.shape[0] - 1
+    if numexpr is not None:
+        # Single pass without the intermediate boolean arrays.
+        in_img = numexpr.evaluate(
+            '(x > 1) & (x < x_max) & (y > 1) & (y < y_max)')
+    else:
+        in_img = (x > 1) & (x < x_max) & (y > 1) & (y < y_max)
+    mask = np.zeros(len(lidar_points), dtype=bool)
+    mask[front_idxes[in_img]] = True
+    points = points[in_img]
+    coloring = coloring[in_img]
     return points, coloring, mask
 
 class NuscMVDetDataset(Dataset):
+    # Number of (sample, cameras) entries kept by `_get_global2ego`.
+    global2ego_cache_size = 4096
+
     def __init__(self,
                  ida_aug_conf,
                  classes,
@@ -266,7 +329,9 @@ class NuscMVDetDataset(Dataset):
                  return_depth=False,
                  sweep_idxes=list(),
                  key_idxes=list(),
-                 load_dim=4):
+                 load_dim=4,
+                 use_cuda_warp=False,
+                 mats_cache_dir=None):
         """Dataset used for bevdetection task.
         Args:
             ida_aug_conf (dict): Config for ida augmentation.
@@ -282,6 +347,13 @@ class NuscMVDetDataset(Dataset):
                 default: list().
             key_idxes (list): List of key idxes to be used.
                 default: list().
+            use_cuda_warp (bool): Whether to run the extrinsic augmentation
+                warp with OpenCV's CUDA module, if it is available. Needs
+                dataloader workers started with the spawn method.
+                default: False.
+            mats_cache_dir (str): Directory to cache the camera matrices
+                in, shared by datasets of different info files.
+                default: None, a directory next to `info_path`.
         """
         super().__init__()
         self.infos = mmcv.load(info_path)
@@ -289,6 +361,7 @@ class NuscMVDetDataset(Dataset):
         self.ida_aug_conf = ida_aug_conf
         self.data_root = data_root
         self.classes = classes
+        self._cls_idx = {name: i for i, name in enumerate(self.classes)}
         self.use_cbgs = use_cbgs
         if self.use_cbgs:
             self.cat2id = {name: i for i, name in enumerate(self.classes)}
@@ -310,7 +383,208 @@ class NuscMVDetDataset(Dataset):
         self.ratio_range = [1.0, 0.20]
         self.roll_range = [0.0, 2.00]
         self.pitch_range = [0.0, 0.67]
-        
+        self.use_intrin_extrin_aug = self.is_train and self.is_img_aug()
+        self.use_cuda_warp = use_cuda_warp and cuda_warp_available()
+        # Mean and std of the (ratio, roll, pitch) augmentation noise.
+        self.intrin_extrin_aug_mean, self.intrin_extrin_aug_std = np.array(
+            [self.ratio_range, self.roll_range, self.pitch_range]).T
+        self._rng = None
+        self._rng_pid = None
+        self._decode_pool = None
+        self._decode_pool_pid = None
+        self._global2ego_cache = OrderedDict()
+        # Placeholder gt shared by all test samples, never modified.
+        self._empty_gt_boxes = np.zeros((0, 7), dtype=np.float32)
+        self._empty_gt_labels = np.zeros(0, dtype=np.int64)
+
+        # Sweeps resolved up front for the full camera set, which is used by
+        # every sample except the training ones with fewer cameras.
+        self._all_cams = tuple(self.ida_aug_conf['cams'])
+        self._sweep_lookup = [{
+            sweep_idx: self._find_sweep(info, sweep_idx, self._all_cams)
+            for sweep_idx in self.sweeps_idx
+        } for info in self.infos]
+
+        self._frame_rows, self._cached_mats = self._load_cached_mats(
+            info_path, mats_cache_dir)
+        # Absolute file paths, joined once. Image paths are indexed by the
+        # row of the camera frame and lidar paths by the info index. Numpy
+        # string arrays keep workers from touching per-string refcounts.
+        img_paths = [None] * len(self._frame_rows)
+        for (info_idx, sweep_idx, cam), row in self._frame_rows.items():
+            info = self.infos[info_idx]
+            frame = info['cam_infos'] if sweep_idx < 0 else \
+                info['sweeps'][sweep_idx]
+            img_paths[row] = os.path.join(data_root, frame[cam]['filename'])
+        self._img_paths = np.array(img_paths)
+        if self.return_depth:
+            self._lidar_paths = np.array([
+                os.path.join(data_root,
+                             info['lidar_infos']['LIDAR_TOP']['filename'])
+                for info in self.infos
+            ])
+
+        # Compile the jitted geometry helpers before the first sample.
+        denorm = get_denorm(np.eye(4, dtype=np.float32))
+        get_sensor2virtual(denorm)
+        get_reference_height(denorm)
+
+    @staticmethod
+    def _get_cam_mats(cam_infos):
+        """Build float32 sensor2ego, ego2global and intrinsic matrices.
+
+        Args:
+            cam_infos (list[dict]): Infos of the camera frames.
+
+        Returns:
+            dict: ``(F, 4, 4)`` sensor2ego, ego2global and intrin arrays.
+        """
+        calibrated_sensors = [
+            cam_info['calibrated_sensor'] for cam_info in cam_infos
+        ]
+        ego_poses = [cam_info['ego_pose'] for cam_info in cam_infos]
+        eye = np.eye(4, dtype=np.float32)
+
+        sensor2ego = np.tile(eye, (len(cam_infos), 1, 1))
+        has_rotation_matrix = np.array([
+            'rotation_matrix' in calibrated_sensor
+            for calibrated_sensor in calibrated_sensors
+        ], dtype=bool)
+        if has_rotation_matrix.any():
+            sensor2ego[has_rotation_matrix, :3, :3] = [
+                calibrated_sensor['rotation_matrix']
+                for calibrated_sensor in calibrated_sensors
+                if 'rotation_matrix' in calibrated_sensor
+            ]
+        if not has_rotation_matrix.all():
+            sensor2ego[~has_rotation_matrix, :3, :3] = \
+                quaternion_to_rotation_matrix([
+                    calibrated_sensor['rotation']
+                    for calibrated_sensor in calibrated_sensors
+                    if 'rotation_matrix' not in calibrated_sensor
+                ])
+        sensor2ego[:, :3, 3] = [
+            calibrated_sensor['translation']
+            for calibrated_sensor in calibrated_sensors
+        ]
+
+        ego2global = np.tile(eye, (len(cam_infos), 1, 1))
+        ego2global[:, :3, :3] = quaternion_to_rotation_matrix(
+            [ego_pose['rotation'] for ego_pose in ego_poses])
+        ego2global[:, :3, 3] = [
+            ego_pose['translation'] for ego_pose in ego_poses
+        ]
+
+        # Intrinsics are 3x3 or 3x4 (KITTI P2), so fill them one by one.
+        intrin = np.tile(eye, (len(cam_infos), 1, 1))
+        for i, calibrated_sensor in enumerate(calibrated_sensors):
+            camera_intrinsic = np.asarray(
+                calibrated_sensor['camera_intrinsic'])
+            intrin[i, :3, :camera_intrinsic.shape[1]] = camera_intrinsic
+        return dict(sensor2ego=sensor2ego, ego2global=ego2global,
+                    intrin=intrin)
+
+    def _build_cam_mats(self):
+        """Compute the matrices of every camera frame of the infos.
+
+        Returns:
+            dict: Row of each camera frame.
+            dict: sensor2ego, ego2global and intrin arrays.
+        """
+        frame_rows = dict()
+        cam_infos = list()
+        for info_idx, info in enumerate(self.infos):
+            frames = [info['cam_infos']] + list(info['sweeps'])
+            for sweep_idx, frame in enumerate(frames, -1):
+                for cam, cam_info in frame.items():
+                    if 'camera_intrinsic' not in cam_info.get(
+                            'calibrated_sensor', dict()):
+                        continue
+                    frame_rows[(info_idx, sweep_idx, cam)] = len(cam_infos)
+                    cam_infos.append(cam_info)
+        return frame_rows, self._get_cam_mats(cam_infos)
+
+    @staticmethod
+    def _write_cached_mats(cache_dir, rows_path, cache):
+        """Write the matrix cache, with the row table last to mark it done."""
+        mmcv.mkdir_or_exist(cache_dir)
+        # Write to unique temporary files first so that concurrent ranks,
+        # possibly on other hosts, never read or write a partial file.
+        for name, mats in cache['mats'].items():
+            fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, mats)
+            os.replace(tmp_path, os.path.join(cache_dir, name + '.npy'))
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+        os.close(fd)
+        mmcv.dump(dict(info_key=cache['info_key'],
+                       frame_rows=cache['frame_rows']),
+                  tmp_path,
+                  file_format='pkl')
+        os.replace(tmp_path, rows_path)
+
+    def _load_cached_mats(self, info_path, cache_dir=None):
+        """Load the per-frame camera matrices, computing them on first use.
+
+        The matrices of every camera frame are stored row-wise (one
+        ``(F, 4, 4)`` array per kind) and memory-mapped, so dataloader
+        workers share the pages instead of each holding a copy. They live
+        in a sidecar directory next to ``info_path`` or, if ``cache_dir``
+        is given, in a subdirectory of it named after the info file, so
+        several datasets can share ``cache_dir``. Rows are looked up
+        through a table keyed by ``(info_idx, sweep_idx, cam)`` where
+        ``sweep_idx`` is -1 for the key frame. If the cache cannot be
+        written, the matrices are kept in memory instead.
+
+        Returns:
+            dict: Row of each camera frame.
+            dict: sensor2ego, ego2global and intrin arrays.
+        """
+        if cache_dir is None:
+            cache_dir = os.path.splitext(info_path)[0] + '_mats'
+        else:
+            # Info files of different splits may share their name.
+            path_hash = hashlib.md5(
+                os.path.realpath(info_path).encode()).hexdigest()[:8]
+            cache_dir = os.path.join(
+                cache_dir,
+                os.path.splitext(os.path.basename(info_path))[0] + '_' +
+                path_hash)
+        rows_path = os.path.join(cache_dir, 'frame_rows.pkl')
+        # Copies that preserve timestamps can make regenerated infos look
+        # older than the cache, so the cache must match the info file
+        # exactly.
+        info_stat = os.stat(info_path)
+        info_key = dict(size=info_stat.st_size,
+                        mtime_ns=info_stat.st_mtime_ns,
+                        num_infos=len(self.infos))
+        cache = mmcv.load(rows_path) if os.path.exists(rows_path) else None
+        if isinstance(cache, dict) and cache.get('info_key') == info_key:
+            try:
+                cached_mats = {
+                    name: np.load(os.path.join(cache_dir, name + '.npy'),
+                                  mmap_mode='r')
+                    for name in ('sensor2ego', 'ego2global', 'intrin')
+                }
+            except (OSError, ValueError):
+                cached_mats = None
+            # The arrays must belong to the row table, otherwise rebuild.
+            if cached_mats is not None and all(
+                    len(mats) == len(cache['frame_rows'])
+                    for mats in cached_mats.values()):
+                return cache['frame_rows'], cached_mats
+        frame_rows, cam_mats = self._build_cam_mats()
+        try:
+            self._write_cached_mats(
+                cache_dir, rows_path,
+                dict(info_key=info_key, frame_rows=frame_rows,
+                     mats=cam_mats))
+        except OSError as e:
+            warnings.warn(f'Cannot write the camera matrix cache to '
+                          f'{cache_dir} ({e}), keeping the matrices in '
+                          'memory.')
+        return frame_rows, cam_mats
+
     def is_img_aug(self,):
         if not self.return_depth:
             return True
@@ -328,17 +602,25 @@ class NuscMVDetDataset(Dataset):
             ann_file (str): Path of the annotation file.
 
         Returns:
-            list[dict]: List of annotations after class sampling.
+            np.ndarray: int64 info indices after class sampling.
         """
         class_sample_idxs = {cat_id: [] for cat_id in self.cat2id.values()}
+        # Resolve general category names to class ids once, None for
+        # categories that are not trained on.
+        general2cat_id = {
+            name: self.cat2id.get(detection_name)
+            for name, detection_name in
+            map_name_from_general_to_detection.items()
+        }
         for idx, info in enumerate(self.infos):
-            gt_names = set(
-                [ann_info['category_name'] for ann_info in info['ann_infos']])
+            gt_names = {
+                ann_info['category_name']
+                for ann_info in info['ann_infos']
+            }
             for gt_name in gt_names:
-                gt_name = map_name_from_general_to_detection[gt_name]
-                if gt_name not in self.classes:
-                    continue
-                class_sample_idxs[self.cat2id[gt_name]].append(idx)
+                cat_id = general2cat_id[gt_name]
+                if cat_id is not None:
+                    class_sample_idxs[cat_id].append(idx)
         duplicated_samples = sum(
             [len(v) for _, v in class_sample_idxs.items()])
         class_distribution = {
@@ -350,10 +632,9 @@ class NuscMVDetDataset(Dataset):
         frac = 1.0 / len(self.classes)
         ratios = [frac / v for v in class_distribution.values()]
         for cls_inds, ratio in zip(list(class_sample_idxs.values()), ratios):
-            sample_indices += np.random.choice(cls_inds,
-                                               int(len(cls_inds) *
-                                                   ratio)).tolist()
-        return sample_indices
+            sample_indices.append(
+                np.random.choice(cls_inds, int(len(cls_inds) * ratio)))
+        return np.concatenate(sample_indices).astype(np.int64)
 
     def degree2rad(self, degree):
         return degree * np.pi / 180
@@ -366,38 +647,65 @@ class NuscMVDetDataset(Dataset):
         M = np.matmul(M, K_inv)
         return M
 
-    def sample_intrin_extrin_augmentation(self, intrin_mat, sweepego2sweepsensor):
-        intrin_mat, sweepego2sweepsensor = intrin_mat.numpy(), sweepego2sweepsensor.numpy()
+    def get_rng(self):
+        """Return the random generator of the current process.
+
+        Dataloader workers get a copy of the dataset, so the generator is
+        created lazily per process and seeded from torch's per-worker seed.
+        """
+        if self._rng_pid != os.getpid():
+            self._rng = np.random.default_rng(torch.initial_seed())
+            self._rng_pid = os.getpid()
+        return self._rng
+
+    def get_decode_pool(self):
+        """Return the image decoding thread pool of the current process.
+
+        Threads do not survive a fork, so the pool is created lazily in each
+        dataloader worker.
+        """
+        if self._decode_pool_pid != os.getpid():
+            self._decode_pool = ThreadPoolExecutor(
+                max_workers=len(self.ida_aug_conf['cams']))
+            self._decode_pool_pid = os.getpid()
+        return self._decode_pool
+
+    def __getstate__(self):
+        # The thread pool can not be pickled for spawned workers.
+        state = self.__dict__.copy()
+        state['_decode_pool'] = None
+        state['_decode_pool_pid'] = None
+        return state
+
+    def sample_intrin_extrin_augmentation(self, intrin_mat, sweepego2sweepsensor, noise):
+        """Apply ratio, roll and pitch noise, drawn by the caller, to a sweep."""
+        ratio, roll, pitch = noise
         # rectify intrin_mat
-        ratio = np.random.normal(self.ratio_range[0], self.ratio_range[1])
         intrin_mat_rectify = intrin_mat.copy()
         intrin_mat_rectify[:2,:2] = intrin_mat[:2,:2] * ratio
         
         # rectify sweepego2sweepsensor by roll
-        roll = np.random.normal(self.roll_range[0], self.roll_range[1])
         roll_rad = self.degree2rad(roll)
         rectify_roll = np.array([[math.cos(roll_rad), -math.sin(roll_rad), 0, 0], 
                                  [math.sin(roll_rad), math.cos(roll_rad), 0, 0], 
                                  [0, 0, 1, 0],
-                                 [0, 0, 0, 1]])
+                                 [0, 0, 0, 1]], dtype=np.float32)
         sweepego2sweepsensor_rectify_roll = np.matmul(rectify_roll, sweepego2sweepsensor)
         
         # rectify sweepego2sweepsensor by pitch
-        pitch = np.random.normal(self.pitch_range[0], self.pitch_range[1])
         pitch_rad = self.degree2rad(pitch)
         rectify_pitch = np.array([[1, 0, 0, 0],
                                   [0,math.cos(pitch_rad), -math.sin(pitch_rad), 0], 
                                   [0,math.sin(pitch_rad), math.cos(pitch_rad), 0],
-                                  [0, 0, 0, 1]])
+                                  [0, 0, 0, 1]], dtype=np.float32)
         sweepego2sweepsensor_rectify_pitch = np.matmul(rectify_pitch, sweepego2sweepsensor_rectify_roll)
         M = self.get_M(sweepego2sweepsensor_rectify_roll[:3,:3], intrin_mat_rectify[:3,:3], sweepego2sweepsensor_rectify_pitch[:3,:3], intrin_mat_rectify[:3,:3])
         center = intrin_mat_rectify[:2, 2]  # w, h
         center_ref = np.array([center[0], center[1], 1.0])
         center_ref = np.matmul(M, center_ref.T)[:2]
-        transform_pitch = int(center_ref[1] - center[1])
+        transform_pitch = center_ref[1] - center[1]
 
-        intrin_mat_rectify, sweepego2sweepsensor_rectify = torch.Tensor(intrin_mat_rectify), torch.Tensor(sweepego2sweepsensor_rectify_pitch)
-        return intrin_mat_rectify, sweepego2sweepsensor_rectify, ratio, roll, transform_pitch
+        return intrin_mat_rectify, sweepego2sweepsensor_rectify_pitch, ratio, roll, transform_pitch
 
     def sample_ida_augmentation(self):
         """Generate ida augmentation values based on ida_config."""
@@ -424,10 +732,9 @@ class NuscMVDetDataset(Dataset):
 
     def get_lidar_height(self, lidar_points, sweepsensor2keyego, sensor2virtual, reference_height):
         keyego2virtual = np.matmul(sensor2virtual, np.linalg.inv(sweepsensor2keyego))
-        lidar_points = LidarPointCloud(lidar_points.T)
-        lidar_points.rotate(keyego2virtual[:3, :3])
-        lidar_points.translate(keyego2virtual[:3, 3])
-        delta_height = reference_height - lidar_points.points[1, :]
+        # Only the height (y) axis of the virtual frame is needed.
+        delta_height = reference_height - (
+            lidar_points[:, :3] @ keyego2virtual[1, :3] + keyego2virtual[1, 3])
         return delta_height
 
     def get_lidar_depth(self, lidar_points, img, lidar_info, cam_info):
@@ -438,15 +745,18 @@ class NuscMVDetDataset(Dataset):
             cam_calibrated_sensor)
         return pts_img, depth, mask 
     
-    def get_image(self, cam_infos, cams, lidar_infos=None):
+    def get_image(self, cam_infos, cams, frame_keys, lidar_infos=None):
         """Given data and cam_names, return image data needed.
 
         Args:
             sweeps_data (list): Raw data used to generate the data we needed.
             cams (list): Camera names.
+            frame_keys (list): (info_idx, sweep_idx) of each item in
+                sweeps_data, used to look up the cached matrices.
 
         Returns:
-            Tensor: Image data after processing.
+            Tensor: uint8 image data after processing, to be normalized
+                with `normalize_imgs`.
             Tensor: Transformation matrix from camera to ego.
             Tensor: Intrinsic matrix.
             Tensor: Transformation matrix for ida.
@@ -456,167 +766,140 @@ class NuscMVDetDataset(Dataset):
             dict: meta infos needed for evaluation.
         """
         assert len(cam_infos) > 0
-        sweep_imgs = list()
-        sweep_sensor2ego_mats = list()
-        sweep_intrin_mats = list()
-        sweep_ida_mats = list()
-        sweep_sensor2sensor_mats = list()
-        sweep_sensor2virtual_mats = list()
-        sweep_timestamps = list()
-        sweep_reference_heights = list()
-
-        gt_depth, gt_height = list(), list()
-        for cam in cams:
-            imgs = list()
-            sensor2ego_mats = list()
-            intrin_mats = list()
-            ida_mats = list()
-            sensor2sensor_mats = list()
-            sensor2virtual_mats=list()
-            reference_heights = list()
-            timestamps = list()
-            sweep_timestamps = list()
+        # Every output is written into a buffer laid out as (sweeps, cams,
+        # ...), so it can be handed to torch without stacking or permuting.
+        num_sweeps, num_cams = len(cam_infos), len(cams)
+        sweep_imgs = None
+        sweep_sensor2ego_mats = np.empty((num_sweeps, num_cams, 4, 4),
+                                         dtype=np.float32)
+        sweep_intrin_mats = np.empty_like(sweep_sensor2ego_mats)
+        sweep_ida_mats = np.empty_like(sweep_sensor2ego_mats)
+        sweep_sensor2sensor_mats = np.empty_like(sweep_sensor2ego_mats)
+        sweep_sensor2virtual_mats = np.empty_like(sweep_sensor2ego_mats)
+        sweep_timestamps = np.empty((num_sweeps, num_cams), dtype=np.int64)
+        sweep_reference_heights = np.empty((num_sweeps, num_cams),
+                                           dtype=np.float32)
 
+        if self.return_depth:
+            final_H, final_W = self.ida_aug_conf['final_dim']
+            gt_depth = np.empty((num_cams, final_H, final_W),
+                                dtype=np.float32)
+            gt_height = np.empty_like(gt_depth)
+        # Decode the images of all cams up front. Decoding releases the GIL,
+        # so the cams are decoded concurrently on a thread pool.
+        img_paths = [
+            self._img_paths[self._frame_rows[frame_key + (cam, )]]
+            for cam in cams for frame_key in frame_keys
+        ]
+        if len(cams) > 1:
+            cam_imgs = list(self.get_decode_pool().map(imread, img_paths))
+        else:
+            cam_imgs = [imread(img_path) for img_path in img_paths]
+        for cam_idx, cam in enumerate(cams):
             key_info = cam_infos[0]
             resize, resize_dims, crop, flip, \
                 rotate_ida = self.sample_ida_augmentation(
                     )
+            # Gather the poses of all sweeps so that inverses and
+            # compositions are done with one batched call each. The first
+            # row is the key frame.
+            rows = [
+                self._frame_rows[frame_key + (cam, )]
+                for frame_key in frame_keys
+            ]
+            intrin_mats = self._cached_mats['intrin'][rows]
+            sweepego2global = self._cached_mats['ego2global'][rows]
+            sweepsensor2sweepego = self._cached_mats['sensor2ego'][rows]
+            sweepego2sweepsensor = np.linalg.inv(sweepsensor2sweepego)
+            # global sensor to cur ego, cur ego to sensor
+            global2keyego, keyego2keysensor = np.linalg.inv(
+                np.stack([sweepego2global[0], sweepsensor2sweepego[0]]))
+            aug_params = [None] * len(cam_infos)
+            if self.use_intrin_extrin_aug:
+                # Draw the choice and noise of every sweep at once.
+                rng = self.get_rng()
+                aug_mask = rng.random(len(cam_infos)) < 0.5
+                aug_noise = rng.normal(self.intrin_extrin_aug_mean,
+                                       self.intrin_extrin_aug_std,
+                                       size=(len(cam_infos), 3))
+                for sweep_idx in np.flatnonzero(aug_mask):
+                    intrin_mats[sweep_idx], sweepego2sweepsensor[sweep_idx], ratio, roll, transform_pitch = \
+                        self.sample_intrin_extrin_augmentation(
+                            intrin_mats[sweep_idx], sweepego2sweepsensor[sweep_idx],
+                            aug_noise[sweep_idx])
+                    aug_params[sweep_idx] = (ratio, roll, transform_pitch)
+            sweepsensor2sweepego = np.linalg.inv(sweepego2sweepsensor)
+            sensor2ego_mats = global2keyego @ sweepego2global @ \
+                sweepsensor2sweepego
+            sensor2sensor_mats = np.linalg.inv(
+                keyego2keysensor @ sensor2ego_mats)
+
             for sweep_idx, cam_info in enumerate(cam_infos):
-                if "waymo" in self.data_root:
-                    img = cv2.imread(os.path.join(self.data_root, cam_info[cam]['filename']))
-                    img = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
-                else:
-                    img = Image.open(os.path.join(self.data_root, cam_info[cam]['filename']))
-                if "rotation_matrix" in cam_info[cam]['calibrated_sensor'].keys():
-                    sweepsensor2sweepego_rot = torch.Tensor(cam_info[cam]['calibrated_sensor']['rotation_matrix'])
-                else:
-                    w, x, y, z = cam_info[cam]['calibrated_sensor']['rotation']
-                    # sweep sensor to sweep ego
-                    sweepsensor2sweepego_rot = torch.Tensor(
-                        Quaternion(w, x, y, z).rotation_matrix)
-                sweepsensor2sweepego_tran = torch.Tensor(
-                    cam_info[cam]['calibrated_sensor']['translation'])
-                sweepsensor2sweepego = sweepsensor2sweepego_rot.new_zeros(
-                    (4, 4))
-                sweepsensor2sweepego[3, 3] = 1
-                sweepsensor2sweepego[:3, :3] = sweepsensor2sweepego_rot
-                sweepsensor2sweepego[:3, -1] = sweepsensor2sweepego_tran
-                
-                sweepego2sweepsensor = sweepsensor2sweepego.inverse()
-                denorm = get_denorm(sweepego2sweepsensor.numpy())
-                # sweep ego to global
-                w, x, y, z = cam_info[cam]['ego_pose']['rotation']
-                sweepego2global_rot = torch.Tensor(
-                    Quaternion(w, x, y, z).rotation_matrix)
-                sweepego2global_tran = torch.Tensor(
-                    cam_info[cam]['ego_pose']['translation'])
-                sweepego2global = sweepego2global_rot.new_zeros((4, 4))
-                sweepego2global[3, 3] = 1
-                sweepego2global[:3, :3] = sweepego2global_rot
-                sweepego2global[:3, -1] = sweepego2global_tran
-                
-                intrin_mat = torch.eye(4)
-                if cam_info[cam]['calibrated_sensor']['camera_intrinsic'].shape[1] == 4:
-                    intrin_mat[:3, :] = torch.Tensor(
-                        cam_info[cam]['calibrated_sensor']['camera_intrinsic'])
-                else:
-                    intrin_mat[:3, :3] = torch.Tensor(
-                        cam_info[cam]['calibrated_sensor']['camera_intrinsic'])
-                sweepego2sweepsensor = sweepsensor2sweepego.inverse()
-                data_augmentation = False
-                if self.is_train and random.random() < 0.5 and self.is_img_aug():
-                    data_augmentation = True
-                    intrin_mat, sweepego2sweepsensor, ratio, roll, transform_pitch = self.sample_intrin_extrin_augmentation(intrin_mat, sweepego2sweepsensor)
-                    img = img_intrin_extrin_transform(img, ratio, roll, transform_pitch, intrin_mat.numpy())
-                
-                denorm = get_denorm(sweepego2sweepsensor.numpy())
-                sweepsensor2sweepego = sweepego2sweepsensor.inverse()
-                # global sensor to cur ego
-                w, x, y, z = key_info[cam]['ego_pose']['rotation']
-                keyego2global_rot = torch.Tensor(
-                    Quaternion(w, x, y, z).rotation_matrix)
-                keyego2global_tran = torch.Tensor(
-                    key_info[cam]['ego_pose']['translation'])
-                keyego2global = keyego2global_rot.new_zeros((4, 4))
-                keyego2global[3, 3] = 1
-                keyego2global[:3, :3] = keyego2global_rot
-                keyego2global[:3, -1] = keyego2global_tran
-                global2keyego = keyego2global.inverse()
-
-                # cur ego to sensor
-                if "rotation_matrix" in key_info[cam]['calibrated_sensor'].keys():
-                    keysensor2keyego_rot = torch.Tensor(key_info[cam]['calibrated_sensor']['rotation_matrix'])
-                else:
-                    w, x, y, z = key_info[cam]['calibrated_sensor']['rotation']                    
-                    keysensor2keyego_rot = torch.Tensor(
-                        Quaternion(w, x, y, z).rotation_matrix)
-                keysensor2keyego_tran = torch.Tensor(
-                    key_info[cam]['calibrated_sensor']['translation'])
-                keysensor2keyego = keysensor2keyego_rot.new_zeros((4, 4))
-                keysensor2keyego[3, 3] = 1
-                keysensor2keyego[:3, :3] = keysensor2keyego_rot
-                keysensor2keyego[:3, -1] = keysensor2keyego_tran
-                keyego2keysensor = keysensor2keyego.inverse()
-                keysensor2sweepsensor = (
-                    keyego2keysensor @ global2keyego @ sweepego2global
-                    @ sweepsensor2sweepego).inverse()
-                sweepsensor2keyego = global2keyego @ sweepego2global @\
-                    sweepsensor2sweepego
+                img = cam_imgs[cam_idx * len(frame_keys) + sweep_idx]
+                intrin_mat = intrin_mats[sweep_idx]
+                sweepsensor2keyego = sensor2ego_mats[sweep_idx]
+                data_augmentation = aug_params[sweep_idx] is not None
+                if data_augmentation:
+                    ratio, roll, transform_pitch = aug_params[sweep_idx]
+                    img = img_intrin_extrin_transform(img, ratio, roll, transform_pitch, intrin_mat,
+                                                      use_cuda=self.use_cuda_warp)
+
+                denorm = get_denorm(sweepego2sweepsensor[sweep_idx])
                 sensor2virtual = get_sensor2virtual(denorm)
                 reference_height = get_reference_height(denorm)
-                sensor2ego_mats.append(sweepsensor2keyego)
-                sensor2sensor_mats.append(keysensor2sweepsensor)
-                sensor2virtual_mats.append(torch.Tensor(sensor2virtual))
-                reference_heights.append(reference_height)
+                sweep_sensor2virtual_mats[sweep_idx, cam_idx] = sensor2virtual
+                sweep_reference_heights[sweep_idx, cam_idx] = reference_height
 
                 if self.return_depth and sweep_idx == 0:
-                    lidar_path = lidar_infos[sweep_idx]['LIDAR_TOP']['filename']
-                    if os.path.exists(os.path.join(self.data_root, lidar_path)):
-                        lidar_points = np.fromfile(os.path.join(self.data_root, lidar_path),
-                                                dtype=np.float32,
-                                                count=-1).reshape(-1, 4)[..., :4]
-                    else:
+                    lidar_path = self._lidar_paths[frame_keys[sweep_idx][0]]
+                    if not os.path.exists(lidar_path):
                         lidar_points = np.ones((1000, 4))
-                        
+                    elif os.path.getsize(lidar_path) == 0:
+                        # An empty file cannot be memory-mapped.
+                        lidar_points = np.zeros((0, 4), dtype=np.float32)
+                    else:
+                        # Only the points that project into the image are
+                        # copied out of the mapping.
+                        lidar_points = np.memmap(lidar_path,
+                                                 dtype=np.float32,
+                                                 mode='r').reshape(-1, 4)
+
                     pts_img, depth, mask = self.get_lidar_depth(
-                        lidar_points.copy(), img,
+                        lidar_points, img,
                         lidar_infos[sweep_idx], cam_info[cam])
                     height = self.get_lidar_height(
-                        lidar_points.copy(), sweepsensor2keyego, sensor2virtual, reference_height)
-                    height = height[mask]
-                    point_depth = np.concatenate([pts_img[:2, :].T, depth[:, None]], axis=1).astype(np.float32)
-                    point_height = np.concatenate([pts_img[:2, :].T, height[:, None]], axis=1).astype(np.float32)
-                       
-                    point_depth_augmented = get_depth_map(point_depth, (self.ida_aug_conf['H'], self.ida_aug_conf['W']))
-                    point_height_augmented = get_depth_map(point_height, (self.ida_aug_conf['H'], self.ida_aug_conf['W']))
-                    point_depth_augmented = Image.fromarray(point_depth_augmented)
-                    point_height_augmented = Image.fromarray(point_height_augmented)
+                        lidar_points[mask], sweepsensor2keyego, sensor2virtual, reference_height)
+                    # Move the projected points through the same extrinsic
+                    # and ida warps as the image, then rasterize once at the
+                    # final resolution.
+                    warp_mat = get_ida_mat(resize, crop, flip,
+                                           rotate_ida)[:2, [0, 1, 3]]
                     if data_augmentation:
-                        point_depth_augmented = img_intrin_extrin_transform(point_depth_augmented, ratio, roll, transform_pitch, intrin_mat.numpy(), fillcolor=0)
-                        point_height_augmented = img_intrin_extrin_transform(point_height_augmented, ratio, roll, transform_pitch, intrin_mat.numpy(), fillcolor=10)
-    
-                    point_depth_augmented, _ = img_transform(
-                        point_depth_augmented,
-                        resize=resize,
-                        resize_dims=resize_dims,
-                        crop=crop,
-                        flip=flip,
-                        rotate=rotate_ida,
-                    )
-                    point_height_augmented, _ = img_transform(
-                        point_height_augmented,
-                        resize=resize,
-                        resize_dims=resize_dims,
-                        crop=crop,
-                        flip=flip,
-                        rotate=rotate_ida,
-                    )                                        
-                    point_depth_augmented = np.array(point_depth_augmented)
-                    point_height_augmented = np.array(point_height_augmented)
-                    point_depth_augmented = point_depth_augmented if len(point_depth_augmented.shape) == 2 else point_depth_augmented[:,:,0]
-                    point_height_augmented = point_height_augmented if len(point_height_augmented.shape) == 2 else point_height_augmented[:,:,0]
-                    gt_depth.append(torch.Tensor(point_depth_augmented))
-                    gt_height.append(torch.Tensor(point_height_augmented))
+                        ext_warp_mat = get_intrin_extrin_warp_mat(
+                            ratio, roll, transform_pitch, intrin_mat)
+                        final_warp_mat = warp_mat[:, :2] @ ext_warp_mat
+                        final_warp_mat[:, 2] += warp_mat[:, 2]
+                        # The extrinsic warp keeps the original image size, so
+                        # points it moves out of frame are dropped. Their
+                        # intermediate coordinates come out of the same matmul.
+                        warp_mat = np.concatenate(
+                            [ext_warp_mat, final_warp_mat])
+                        coords = pts_img @ warp_mat[:, :2].T + warp_mat[:, 2]
+                        in_img = ((coords[:, 0] >= 0)
+                                  & (coords[:, 0] < self.ida_aug_conf['W'])
+                                  & (coords[:, 1] >= 0)
+                                  & (coords[:, 1] < self.ida_aug_conf['H']))
+                        pts_img = coords[in_img, 2:]
+                        depth, height = depth[in_img], height[in_img]
+                    else:
+                        pts_img = pts_img @ warp_mat[:, :2].T + warp_mat[:, 2]
+                    final_dims = (crop[3] - crop[1], crop[2] - crop[0])
+                    get_depth_map(
+                        np.concatenate([pts_img, depth[:, None]], axis=1),
+                        final_dims, out=gt_depth[cam_idx])
+                    get_depth_map(
+                        np.concatenate([pts_img, height[:, None]], axis=1),
+                        final_dims, out=gt_height[cam_idx])
 
                 img, ida_mat = img_transform(
                     img,
@@ -639,51 +922,79 @@ class NuscMVDetDataset(Dataset):
                 cv2.imwrite("debug.jpg", image)
                 print(point_depth_augmented.shape, image.shape)
                 '''
-                ida_mats.append(ida_mat)
-                img = mmcv.imnormalize(np.array(img), self.img_mean,
-                                       self.img_std, self.to_rgb)
-                img = torch.from_numpy(img).permute(2, 0, 1)
-                imgs.append(img)
-                intrin_mats.append(intrin_mat)
-                timestamps.append(cam_info[cam]['timestamp'])
-                
-            sweep_imgs.append(torch.stack(imgs))
-            sweep_sensor2ego_mats.append(torch.stack(sensor2ego_mats))
-            sweep_intrin_mats.append(torch.stack(intrin_mats))
-            sweep_ida_mats.append(torch.stack(ida_mats))
-            sweep_sensor2sensor_mats.append(torch.stack(sensor2sensor_mats))
-            sweep_sensor2virtual_mats.append(torch.stack(sensor2virtual_mats))
-            sweep_timestamps.append(torch.tensor(timestamps))
-            sweep_reference_heights.append(torch.tensor(reference_heights))
-            
+                sweep_ida_mats[sweep_idx, cam_idx] = ida_mat
+                # Images are decoded as BGR, so the channels are swapped
+                # only when `to_rgb` is off to feed the network the same
+                # layout as an RGB decode followed by `mmcv.imnormalize`.
+                # Normalization is left to `normalize_imgs` on the device.
+                if not self.to_rgb:
+                    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+                if sweep_imgs is None:
+                    sweep_imgs = np.empty((num_sweeps, num_cams) + img.shape,
+                                          dtype=img.dtype)
+                sweep_imgs[sweep_idx, cam_idx] = img
+                sweep_timestamps[sweep_idx, cam_idx] = cam_info[cam][
+                    'timestamp']
+
+            sweep_sensor2ego_mats[:, cam_idx] = sensor2ego_mats
+            sweep_intrin_mats[:, cam_idx] = intrin_mats
+            sweep_sensor2sensor_mats[:, cam_idx] = sensor2sensor_mats
+
         # Get mean pose of all cams.
-        ego2global_rotation = np.mean(
-            [key_info[cam]['ego_pose']['rotation'] for cam in cams], 0)
-        ego2global_translation = np.mean(
-            [key_info[cam]['ego_pose']['translation'] for cam in cams], 0)
+        ego2global_rotation, ego2global_translation = get_mean_ego_pose(
+            key_info, cams)
         img_metas = dict(
             box_type_3d=LiDARInstance3DBoxes,
             ego2global_translation=ego2global_translation,
             ego2global_rotation=ego2global_rotation,
         )
 
+        # The images are returned as (sweeps, cams, C, H, W) views of the
+        # HWC buffer.
         ret_list = [
-            torch.stack(sweep_imgs).permute(1, 0, 2, 3, 4),
-            torch.stack(sweep_sensor2ego_mats).permute(1, 0, 2, 3),
-            torch.stack(sweep_intrin_mats).permute(1, 0, 2, 3),
-            torch.stack(sweep_ida_mats).permute(1, 0, 2, 3),
-            torch.stack(sweep_sensor2sensor_mats).permute(1, 0, 2, 3),
-            torch.stack(sweep_sensor2virtual_mats).permute(1, 0, 2, 3),
-            torch.stack(sweep_timestamps).permute(1, 0),
-            torch.stack(sweep_reference_heights).permute(1, 0),
+            torch.from_numpy(sweep_imgs).permute(0, 1, 4, 2, 3),
+            torch.from_numpy(sweep_sensor2ego_mats),
+            torch.from_numpy(sweep_intrin_mats),
+            torch.from_numpy(sweep_ida_mats),
+            torch.from_numpy(sweep_sensor2sensor_mats),
+            torch.from_numpy(sweep_sensor2virtual_mats),
+            torch.from_numpy(sweep_timestamps),
+            torch.from_numpy(sweep_reference_heights),
             img_metas,
         ]
         if self.return_depth:
-            ret_list.append(torch.stack(gt_depth))
-            ret_list.append(torch.stack(gt_height))
+            ret_list.append(torch.from_numpy(gt_depth))
+            ret_list.append(torch.from_numpy(gt_height))
 
         return ret_list
 
+    def _get_global2ego(self, info, cams):
+        """Get the global to ego transform of the mean pose of `cams`.
+
+        The result only depends on the sample and the set of cameras, so
+        it is kept in a bounded LRU cache and reused in the following
+        epochs.
+
+        Returns:
+            np.ndarray: Translation to apply before the rotation.
+            np.ndarray: Rotation matrix.
+            np.ndarray: Rotation as a w, x, y, z quaternion.
+        """
+        cams = tuple(sorted(cams))
+        key = (info['sample_token'], cams)
+        cache = self._global2ego_cache
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+        ego2global_rotation, ego2global_translation = get_mean_ego_pose(
+            info['cam_infos'], cams)
+        rot = Quaternion(ego2global_rotation).inverse
+        cache[key] = (-np.array(ego2global_translation), rot.rotation_matrix,
+                      rot.q)
+        if len(cache) > self.global2ego_cache_size:
+            cache.popitem(last=False)
+        return cache[key]
+
     def get_gt(self, info, cams):
         """Generate gt labels from info.
 
@@ -692,44 +1003,62 @@ class NuscMVDetDataset(Dataset):
             cams(list): Camera names.
 
         Returns:
-            Tensor: GT bboxes.
-            Tensor: GT labels.
+            np.ndarray: float32 GT bboxes.
+            np.ndarray: int64 GT labels.
         """
-        ego2global_rotation = np.mean(
-            [info['cam_infos'][cam]['ego_pose']['rotation'] for cam in cams],
-            0)
-        ego2global_translation = np.mean([
-            info['cam_infos'][cam]['ego_pose']['translation'] for cam in cams
-        ], 0)
-        trans = -np.array(ego2global_translation)
-        rot = Quaternion(ego2global_rotation).inverse
-        gt_boxes = list()
-        gt_labels = list()
-        for ann_info in info['ann_infos']:
-            # Use ego coordinate.
-            if (map_name_from_general_to_detection[ann_info['category_name']]
-                    not in self.classes
-                    or ann_info['num_lidar_pts'] + ann_info['num_radar_pts'] <=
-                    0):
-                continue
-            box = Box(
-                ann_info['translation'],
-                ann_info['size'],
-                Quaternion(ann_info['rotation']),
-                velocity=ann_info['velocity'],
-            )
-            box.translate(trans)
-            box.rotate(rot)
-            box_xyz = np.array(box.center)
-            box_dxdydz = np.array(box.wlh)[[1, 0, 2]]
-            box_yaw = np.array([box.orientation.yaw_pitch_roll[0]])
-            box_velo = np.array(box.velocity[:2])
-            gt_box = np.concatenate([box_xyz, box_dxdydz, box_yaw, box_velo])
-            gt_boxes.append(gt_box)
-            gt_labels.append(
-                self.classes.index(map_name_from_general_to_detection[
-                    ann_info['category_name']]))
-        return torch.Tensor(gt_boxes), torch.tensor(gt_labels)
+        trans, rot_mat, rot_q = self._get_global2ego(info, cams)
+        ann_infos = [
+            ann_info for ann_info in info['ann_infos']
+            if map_name_from_general_to_detection[ann_info['category_name']]
+            in self._cls_idx
+            and ann_info['num_lidar_pts'] + ann_info['num_radar_pts'] > 0
+        ]
+        gt_labels = np.fromiter(
+            (self._cls_idx[map_name_from_general_to_detection[
+                ann_info['category_name']]] for ann_info in ann_infos),
+            dtype=np.int64,
+            count=len(ann_infos))
+        # Use ego coordinate. All boxes are moved at once, the same way as
+        # `Box.translate` followed by `Box.rotate`.
+        box_xyz = (np.array([ann_info['translation'] for ann_info in ann_infos
+                             ]).reshape(-1, 3) + trans) @ rot_mat.T
+        box_dxdydz = np.array([ann_info['size'] for ann_info in ann_infos
+                               ]).reshape(-1, 3)[:, [1, 0, 2]]
+        box_velo = (np.array([ann_info['velocity'] for ann_info in ann_infos
+                              ]).reshape(-1, 3) @ rot_mat.T)[:, :2]
+        # Hamilton product `rot * orientation`, then the yaw of
+        # `Quaternion.yaw_pitch_roll` on the normalized result. The info
+        # scripts store the orientations as `Quaternion` objects.
+        w0, x0, y0, z0 = rot_q
+        w, x, y, z = np.array([
+            getattr(ann_info['rotation'], 'q', ann_info['rotation'])
+            for ann_info in ann_infos
+        ]).reshape(-1, 4).T
+        qw = w0 * w - x0 * x - y0 * y - z0 * z
+        qx = w0 * x + x0 * w + y0 * z - z0 * y
+        qy = w0 * y - x0 * z + y0 * w + z0 * x
+        qz = w0 * z + x0 * y - y0 * x + z0 * w
+        norm = np.sqrt(qw**2 + qx**2 + qy**2 + qz**2)
+        qw, qx, qy, qz = qw / norm, qx / norm, qy / norm, qz / norm
+        box_yaw = np.arctan2(2 * (qw * qz - qx * qy),
+                             1 - 2 * (qy**2 + qz**2))
+        gt_boxes = np.concatenate(
+            [box_xyz, box_dxdydz, box_yaw[:, None], box_velo],
+            axis=1).astype(np.float32)
+        return gt_boxes, gt_labels
+
+    @staticmethod
+    def _find_sweep(info, sweep_idx, cams):
+        """Find the latest sweep up to `sweep_idx` that has all `cams`.
+
+        Returns:
+            int | None: Index of the sweep, None if no sweep qualifies.
+        """
+        cams = frozenset(cams)
+        for i in range(min(len(info['sweeps']) - 1, sweep_idx), -1, -1):
+            if cams <= info['sweeps'][i].keys():
+                return i
+        return None
 
     def choose_cams(self):
         """Choose cameras randomly.
@@ -748,8 +1077,8 @@ class NuscMVDetDataset(Dataset):
 
     def __getitem__(self, idx):
         if self.use_cbgs:
-            idx = self.sample_indices[idx]
-        cam_infos, lidar_infos = list(), list()
+            idx = int(self.sample_indices[idx])
+        cam_infos, lidar_infos, frame_keys = list(), list(), list()
         # TODO: Check if it still works when number of cameras is reduced.
         cams = self.choose_cams()
         for key_idx in self.key_idxes:
@@ -764,65 +1093,42 @@ class NuscMVDetDataset(Dataset):
             info = self.infos[cur_idx]
             cam_infos.append(info['cam_infos'])
             lidar_infos.append(info['lidar_infos'])
+            frame_keys.append((cur_idx, -1))
             for sweep_idx in self.sweeps_idx:
                 if len(info['sweeps']) == 0:
                     cam_infos.append(info['cam_infos'])
                     lidar_infos.append(info['lidar_infos'])
+                    frame_keys.append((cur_idx, -1))
                 else:
                     # Handle scenarios when current sweep doesn't have all
                     # cam keys.
-                    for i in range(min(len(info['sweeps']) - 1, sweep_idx), -1,
-                                   -1):
-                        if sum([cam in info['sweeps'][i]
-                                for cam in cams]) == len(cams):
-                            cam_infos.append(info['sweeps'][i])
-                            break
-        image_data_list = self.get_image(cam_infos, cams, lidar_infos)
-        ret_list = list()
-        (
-            sweep_imgs,
-            sweep_sensor2ego_mats,
-            sweep_intrins,
-            sweep_ida_mats,
-            sweep_sensor2sensor_mats,
-            sweep_sensor2virtual_mats,
-            sweep_timestamps,
-            sweep_reference_heights,
-            img_metas,
-        ) = image_data_list[:9]
+                    if tuple(cams) == self._all_cams:
+                        i = self._sweep_lookup[cur_idx][sweep_idx]
+                    else:
+                        i = self._find_sweep(info, sweep_idx, cams)
+                    if i is not None:
+                        cam_infos.append(info['sweeps'][i])
+                        frame_keys.append((cur_idx, i))
+        ret_list = self.get_image(cam_infos, cams, frame_keys, lidar_infos)
+        img_metas = ret_list[8]
         img_metas['token'] = self.infos[idx]['sample_token']
         if self.is_train:
             gt_boxes, gt_labels = self.get_gt(self.infos[idx], cams)
         # Temporary solution for test.
         else:
-            gt_boxes = sweep_imgs.new_zeros(0, 7)
-            gt_labels = sweep_imgs.new_zeros(0, )
+            gt_boxes = self._empty_gt_boxes
+            gt_labels = self._empty_gt_labels
         
         rotate_bda, scale_bda, flip_dx, flip_dy = self.sample_bda_augmentation(
         )
 
-        bda_mat = sweep_imgs.new_zeros(4, 4)
-        bda_mat[3, 3] = 1
-        gt_boxes, bda_rot = bev_transform(gt_boxes, rotate_bda, scale_bda,
+        gt_boxes, bda_mat = bev_transform(gt_boxes, rotate_bda, scale_bda,
                                           flip_dx, flip_dy)
-        bda_mat[:3, :3] = bda_rot
-        ret_list = [
-            sweep_imgs,
-            sweep_sensor2ego_mats,
-            sweep_intrins,
-            sweep_ida_mats,
-            sweep_sensor2sensor_mats,
-            sweep_sensor2virtual_mats,
-            bda_mat,
-            sweep_timestamps,
-            sweep_reference_heights,
-            img_metas,
-            gt_boxes,
-            gt_labels,
-        ]
-        if self.return_depth:
-            ret_list.append(image_data_list[9])
-            ret_list.append(image_data_list[10])
+        # Reuse the list from `get_image`: the bda matrix goes before the
+        # timestamps and the gt after img_metas, ahead of the optional depth
+        # and height labels.
+        ret_list.insert(6, bda_mat)
+        ret_list[10:10] = [gt_boxes, gt_labels]
 
         return ret_list
 
@@ -837,21 +1143,67 @@ class NuscMVDetDataset(Dataset):
         else:
             return len(self.infos)
 
+
+def _empty_shared(shape, dtype):
+    """Allocate an uninitialized tensor directly in shared memory.
+
+    This mirrors `default_collate` in DataLoader workers: a batch that
+    already lives in shared memory is sent to the main process as a handle
+    instead of being copied into shared memory first.
+    """
+    elem = torch.empty(0, dtype=dtype)
+    numel = int(np.prod(shape))
+    if hasattr(elem, '_typed_storage'):
+        storage = elem._typed_storage()._new_shared(numel, device=elem.device)
+    else:
+        storage = elem.storage()._new_shared(numel)
+    return elem.new(storage).view(shape)
+
+
+def _empty_batch(shape, dtype, pin_memory=False, shared=False):
+    """Allocate an uninitialized batch, pinned or in shared memory."""
+    if shared:
+        return _empty_shared(shape, dtype)
+    return torch.empty(shape, dtype=dtype, pin_memory=pin_memory)
+
+
+def _alloc_batch(sample, batch_size, pin_memory=False, shared=False):
+    """Allocate an uninitialized batch shaped after one sample's tensor."""
+    return _empty_batch((batch_size, ) + tuple(sample.shape), sample.dtype,
+                        pin_memory, shared)
+
 def collate_fn(data, is_return_depth=False):
-    imgs_batch = list()
-    sensor2ego_mats_batch = list()
-    intrin_mats_batch = list()
-    ida_mats_batch = list()
-    sensor2sensor_mats_batch = list()
-    sensor2virtual_mats_batch = list()
-    bda_mat_batch = list()
-    timestamps_batch = list()
-    reference_heights_batch = list()
+    # Every tensor is copied straight into a batch allocated up front from
+    # the shapes of the first sample instead of being listed and stacked.
+    batch_size = len(data)
+    first = data[0]
+    # Collating in the main process allocates the batch pinned so it can be
+    # copied to the device asynchronously right away. Workers allocate it
+    # in shared memory instead, where they have to send it anyway, and
+    # leave pinning to the pin memory thread of the DataLoader.
+    shared = get_worker_info() is not None
+    pin = torch.cuda.is_available() and not shared
+    # Lay the images out channels_last so that the backbone input can be
+    # viewed as NHWC without another copy after the host to device transfer.
+    num_sweeps, num_cams, num_channels, imH, imW = first[0].shape
+    imgs = _empty_batch(
+        (batch_size, num_sweeps, num_cams, imH, imW, num_channels),
+        first[0].dtype, pin, shared).permute(0, 1, 2, 5, 3, 4)
+    sensor2ego_mats = _alloc_batch(first[1], batch_size, pin, shared)
+    intrin_mats = _alloc_batch(first[2], batch_size, pin, shared)
+    ida_mats = _alloc_batch(first[3], batch_size, pin, shared)
+    sensor2sensor_mats = _alloc_batch(first[4], batch_size, pin, shared)
+    sensor2virtual_mats = _alloc_batch(first[5], batch_size, pin, shared)
+    bda_mats = _alloc_batch(first[6], batch_size, pin, shared)
+    timestamps = _alloc_batch(first[7], batch_size, pin, shared)
+    reference_heights = _alloc_batch(first[8], batch_size, pin, shared)
+    if is_return_depth:
+        depth_labels = _alloc_batch(first[12], batch_size, pin, shared)
+        height_labels = _alloc_batch(first[13], batch_size, pin, shared)
     gt_boxes_batch = list()
     gt_labels_batch = list()
     img_metas_batch = list()
-    depth_labels_batch, height_labels_batch = list(), list()
-    for iter_data in data:
+    for i, iter_data in enumerate(data):
         (
             sweep_imgs,
             sweep_sensor2ego_mats,
@@ -867,39 +1219,38 @@ def collate_fn(data, is_return_depth=False):
             gt_labels,
         ) = iter_data[:12]
         if is_return_depth:
-            gt_depth, gt_height = iter_data[12], iter_data[13]
-            depth_labels_batch.append(gt_depth)
-            height_labels_batch.append(gt_height)
-        imgs_batch.append(sweep_imgs)
-        sensor2ego_mats_batch.append(sweep_sensor2ego_mats)
-        intrin_mats_batch.append(sweep_intrins)
-        ida_mats_batch.append(sweep_ida_mats)
-        sensor2sensor_mats_batch.append(sweep_sensor2sensor_mats)
-        sensor2virtual_mats_batch.append(sweep_sensor2virtual_mats)
-        bda_mat_batch.append(bda_mat)
-        timestamps_batch.append(sweep_timestamps)
-        reference_heights_batch.append(sweep_reference_heights)
+            depth_labels[i].copy_(iter_data[12])
+            height_labels[i].copy_(iter_data[13])
+        imgs[i].copy_(sweep_imgs)
+        sensor2ego_mats[i].copy_(sweep_sensor2ego_mats)
+        intrin_mats[i].copy_(sweep_intrins)
+        ida_mats[i].copy_(sweep_ida_mats)
+        sensor2sensor_mats[i].copy_(sweep_sensor2sensor_mats)
+        sensor2virtual_mats[i].copy_(sweep_sensor2virtual_mats)
+        bda_mats[i].copy_(bda_mat)
+        timestamps[i].copy_(sweep_timestamps)
+        reference_heights[i].copy_(sweep_reference_heights)
         img_metas_batch.append(img_metas)
         gt_boxes_batch.append(gt_boxes)
         gt_labels_batch.append(gt_labels)
     mats_dict = dict()
-    mats_dict['sensor2ego_mats'] = torch.stack(sensor2ego_mats_batch)
-    mats_dict['intrin_mats'] = torch.stack(intrin_mats_batch)
-    mats_dict['ida_mats'] = torch.stack(ida_mats_batch)
-    mats_dict['reference_heights'] = torch.stack(reference_heights_batch)
-    mats_dict['sensor2sensor_mats'] = torch.stack(sensor2sensor_mats_batch)
-    mats_dict['sensor2virtual_mats'] = torch.stack(sensor2virtual_mats_batch)
-    mats_dict['bda_mat'] = torch.stack(bda_mat_batch)
+    mats_dict['sensor2ego_mats'] = sensor2ego_mats
+    mats_dict['intrin_mats'] = intrin_mats
+    mats_dict['ida_mats'] = ida_mats
+    mats_dict['reference_heights'] = reference_heights
+    mats_dict['sensor2sensor_mats'] = sensor2sensor_mats
+    mats_dict['sensor2virtual_mats'] = sensor2virtual_mats
+    mats_dict['bda_mat'] = bda_mats
     ret_list = [
-        torch.stack(imgs_batch),
+        imgs,
         mats_dict,
-        torch.stack(timestamps_batch),
+        timestamps,
         img_metas_batch,
         gt_boxes_batch,
         gt_labels_batch,
     ]
     if is_return_depth:
-        ret_list.append(torch.stack(depth_labels_batch))
-        ret_list.append(torch.stack(height_labels_batch))
+        ret_list.append(depth_labels)
+        ret_list.append(height_labels)
 
     return ret_list
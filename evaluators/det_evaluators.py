@@ -6,8 +6,6 @@ import tempfile
 
 import mmcv
 import numpy as np
-import pyquaternion
-from nuscenes.utils.data_classes import Box
 from pyquaternion import Quaternion
 
 from evaluators.result2kitti import result2kitti, result2kitti_dair, result2kitti_rope3d, kitti_evaluation
@@ -116,20 +114,30 @@ class RoadSideEvaluator():
             sample_token = img_metas[sample_id]['token']
             trans = np.array(img_metas[sample_id]['ego2global_translation'])
             rot = Quaternion(img_metas[sample_id]['ego2global_rotation'])
+            # Move all boxes to global coordinates at once, the same way as
+            # `Box.rotate` followed by `Box.translate`.
+            rot_mat = rot.rotation_matrix
+            centers = boxes[:, :3] @ rot_mat.T + trans
+            velocities = np.zeros((len(boxes), 3))
+            velocities[:, :2] = boxes[:, 7:9]
+            velocities = velocities @ rot_mat.T
+            speeds = np.sqrt(velocities[:, 0]**2 + velocities[:, 1]**2)
+            # Hamilton product of `rot` and the yaw quaternions
+            # (cos(yaw / 2), 0, 0, sin(yaw / 2)).
+            w0, x0, y0, z0 = rot.q
+            half_yaws = boxes[:, 6].astype(np.float64) / 2.0
+            half_cos, half_sin = np.cos(half_yaws), np.sin(half_yaws)
+            orientations = np.stack([
+                w0 * half_cos - z0 * half_sin,
+                x0 * half_cos + y0 * half_sin,
+                y0 * half_cos - x0 * half_sin,
+                z0 * half_cos + w0 * half_sin,
+            ], axis=1)
             annos = list()
             for i, box in enumerate(boxes):
                 name = mapped_class_names[labels[i]]
-                center = box[:3]
-                wlh = box[[4, 3, 5]]
                 box_yaw = box[6]
-                box_vel = box[7:].tolist()
-                box_vel.append(0)
-                quat = pyquaternion.Quaternion(axis=[0, 0, 1], radians=box_yaw)
-                nusc_box = Box(center, wlh, quat, velocity=box_vel)
-                nusc_box.rotate(rot)
-                nusc_box.translate(trans)
-                if np.sqrt(nusc_box.velocity[0]**2 +
-                           nusc_box.velocity[1]**2) > 0.2:
+                if speeds[i] > 0.2:
                     if name in [
                             'car',
                             'construction_vehicle',
@@ -151,11 +159,11 @@ class RoadSideEvaluator():
                         attr = self.DefaultAttribute[name]
                 nusc_anno = dict(
                     sample_token=sample_token,
-                    translation=nusc_box.center.tolist(),
-                    size=nusc_box.wlh.tolist(),
-                    rotation=nusc_box.orientation.elements.tolist(),
+                    translation=centers[i].tolist(),
+                    size=box[[4, 3, 5]].tolist(),
+                    rotation=orientations[i].tolist(),
                     box_yaw=box_yaw,
-                    velocity=nusc_box.velocity[:2],
+                    velocity=velocities[i, :2],
                     detection_name=name,
                     detection_score=float(scores[i]),
                     attribute_name=attr,
@@ -15,7 +15,7 @@ from torch.cuda.amp.autocast_mode import autocast
 from pytorch_lightning.callbacks import ModelCheckpoint
 from torch.optim.lr_scheduler import MultiStepLR
 
-from dataset.nusc_mv_det_dataset import NuscMVDetDataset, collate_fn
+from dataset.nusc_mv_det_dataset import NuscMVDetDataset, collate_fn, normalize_imgs
 from evaluators.det_evaluators import RoadSideEvaluator
 from models.bev_height_plus import BEVHeightPlus
 from utils.torch_dist import all_gather_object, get_rank, synchronize
@@ -241,14 +241,19 @@ class BEVHeightPlusLightningModel(LightningModule):
             (sweep_imgs, mats, timestamps, img_metas, gt_boxes, gt_labels, depth_labels, height_labels) = batch
         else:
             (sweep_imgs, mats, timestamps, img_metas, gt_boxes, gt_labels) = batch
+        # The dataset hands over the ragged gt as numpy arrays.
+        gt_boxes = [torch.from_numpy(gt_box) for gt_box in gt_boxes]
+        gt_labels = [torch.from_numpy(gt_label) for gt_label in gt_labels]
         
         if torch.cuda.is_available():
             for key, value in mats.items():
                 mats[key] = value.cuda()
             
-            sweep_imgs = sweep_imgs.cuda()
-            gt_boxes = [gt_box.cuda() for gt_box in gt_boxes]
-            gt_labels = [gt_label.cuda() for gt_label in gt_labels]
+            sweep_imgs = sweep_imgs.cuda(non_blocking=True)
+            gt_boxes = [gt_box.cuda(non_blocking=True) for gt_box in gt_boxes]
+            gt_labels = [gt_label.cuda(non_blocking=True) for gt_label in gt_labels]
+        sweep_imgs = normalize_imgs(sweep_imgs, self.img_conf['img_mean'],
+                                    self.img_conf['img_std'])
 
         if self.return_depth:
             if model_type == 0:
@@ -398,7 +403,9 @@ class BEVHeightPlusLightningModel(LightningModule):
         if torch.cuda.is_available():
             for key, value in mats.items():
                 mats[key] = value.cuda()
-            sweep_imgs = sweep_imgs.cuda()
+            sweep_imgs = sweep_imgs.cuda(non_blocking=True)
+        sweep_imgs = normalize_imgs(sweep_imgs, self.img_conf['img_mean'],
+                                    self.img_conf['img_std'])
         preds = self.model(sweep_imgs, mats)
         if isinstance(self.model, torch.nn.parallel.DistributedDataParallel):
             results = self.model.module.get_bboxes(preds, img_metas)
@@ -478,6 +485,9 @@ class BEVHeightPlusLightningModel(LightningModule):
             train_dataset,
             batch_size=self.batch_size_per_device,
             num_workers=4,
+            pin_memory=True,
+            persistent_workers=True,
+            prefetch_factor=4,
             drop_last=True,
             shuffle=False,
             collate_fn=partial(collate_fn,
@@ -505,6 +515,9 @@ class BEVHeightPlusLightningModel(LightningModule):
             shuffle=False,
             collate_fn=collate_fn,
             num_workers=4,
+            pin_memory=True,
+            persistent_workers=True,
+            prefetch_factor=4,
             sampler=None,
         )
         return val_loader
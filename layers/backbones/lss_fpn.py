@@ -431,8 +431,9 @@ class LSSFPN(nn.Module):
         """Get feature maps from images."""
         batch_size, num_sweeps, num_cams, num_channels, imH, imW = imgs.shape
 
-        imgs = imgs.flatten().view(batch_size * num_sweeps * num_cams,
-                                   num_channels, imH, imW)
+        imgs = imgs.reshape(batch_size * num_sweeps * num_cams, num_channels,
+                            imH, imW).contiguous(
+                                memory_format=torch.channels_last)
         img_feats = self.img_neck(self.img_backbone(imgs))[0]
         img_feats = img_feats.reshape(batch_size, num_sweeps, num_cams,
                                       img_feats.shape[1], img_feats.shape[2],